@@ -3,9 +3,15 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
+from streamlit_javascript import st_javascript
 import requests
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Configuration
 st.set_page_config(
@@ -17,6 +23,19 @@ st.set_page_config(
 
 API_URL = "http://localhost:8000/api"
 
+TIMEOUT = (2, 5)  # (connect, read) seconds
+
+@st.cache_resource
+def get_session():
+    # One pooled session per server process, reused across reruns
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=Retry(total=2, backoff_factor=0.2))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+SESSION = get_session()
+
 # Custom CSS
 st.markdown("""
 <style>
@@ -33,45 +52,133 @@ st.markdown("""
 # HELPER FUNCTIONS
 # =============================================================================
 
-@st.cache_data(ttl=60)
-def fetch_stats():
-    try:
-        response = requests.get(f"{API_URL}/stats")
-        return response.json()
-    except Exception as e:
-        st.error(f"Error fetching stats: {e}")
-        return None
+class SWRStore:
+    # Stale-while-revalidate: fresh -> cached, stale -> cached + background refresh, expired -> block
+    def __init__(self, fresh_ttl, swr_ttl):
+        self.fresh_ttl = fresh_ttl
+        self.swr_ttl = swr_ttl
+        self.entries = {}  # key -> (value, fetched_at)
+        self.errors = {}   # key -> exception from the last failed background refresh
+        self.refreshing = set()
+        self.lock = threading.Lock()
 
-@st.cache_data(ttl=60)
-def fetch_users(search="", status="", limit=100):
-    try:
-        params = {"limit": limit}
-        if search:
-            params["search"] = search
-        if status:
-            params["status"] = status
-        response = requests.get(f"{API_URL}/users", params=params)
-        return response.json()
-    except Exception as e:
-        st.error(f"Error fetching users: {e}")
-        return []
+    @staticmethod
+    def key(args, kwargs):
+        return (args, tuple(sorted(kwargs.items())))
+
+    def get(self, fn, args, kwargs):
+        key = self.key(args, kwargs)
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.fresh_ttl:
+                return value
+            if age < self.fresh_ttl + self.swr_ttl:
+                with self.lock:
+                    if key not in self.refreshing:
+                        self.refreshing.add(key)
+                        threading.Thread(target=self._background_refresh, args=(key, fn, args, kwargs), daemon=True).start()
+                return value
+        return self._refresh(key, fn, args, kwargs)
+
+    def _refresh(self, key, fn, args, kwargs):
+        # A failed fetch raises and leaves the previous entry in place
+        try:
+            value = fn(*args, **kwargs)
+        except Exception as e:
+            self.errors[key] = e
+            raise
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+        self.entries[key] = (value, time.monotonic())
+        self.errors.pop(key, None)
+        return value
+
+    def _background_refresh(self, key, fn, args, kwargs):
+        try:
+            self._refresh(key, fn, args, kwargs)
+        except Exception:
+            pass  # recorded in self.errors; surfaced by the next rerun that reads this key
+
+    def clear(self):
+        self.entries.clear()
+
+@st.cache_resource
+def _swr_store(name, fresh_ttl, swr_ttl):
+    # Process-wide, so background refreshes outlive the rerun that started them
+    return SWRStore(fresh_ttl, swr_ttl)
+
+def swr_cache(fresh_ttl=30, swr_ttl=120, default=None):
+    # fn must raise on failure; errors are reported here, in the calling rerun
+    def decorator(fn):
+        label = fn.__name__.replace("fetch_", "")
+        def wrapper(*args, **kwargs):
+            store = _swr_store(fn.__name__, fresh_ttl, swr_ttl)
+            try:
+                value = store.get(fn, args, kwargs)
+            except Exception as e:
+                st.error(f"Error fetching {label}: {e}")
+                return default
+            error = store.errors.get(SWRStore.key(args, kwargs))
+            if error is not None:
+                st.warning(f"Showing cached {label}; refresh failed: {error}")
+            return value
+        wrapper.clear = lambda: _swr_store(fn.__name__, fresh_ttl, swr_ttl).clear()
+        return wrapper
+    return decorator
+
+@st.cache_resource
+def _users_etags():
+    # query params -> (etag, users, total) of the last full /users response
+    return {}
+
+@swr_cache(default=([], 0))
+def fetch_users(search="", status="", page=1, page_size=25):
+    # Returns (users on this page, total matching users)
+    params = {"offset": (page - 1) * page_size, "limit": page_size}
+    if search:
+        params["search"] = search
+    if status:
+        params["status"] = status
+    key = tuple(sorted(params.items()))
+    etags = _users_etags()
+    previous = etags.get(key)
+    headers = {"If-None-Match": previous[0]} if previous else {}
+    response = SESSION.get(f"{API_URL}/users", params=params, headers=headers, timeout=TIMEOUT)
+    if response.status_code == 304 and previous:
+        # Unchanged page: skip the download and JSON parse
+        return previous[1], previous[2]
+    response.raise_for_status()
+    users, total = response.json(), int(response.headers.get("X-Total-Count", 0))
+    if "ETag" in response.headers:
+        etags[key] = (response.headers["ETag"], users, total)
+    return users, total
+
+@swr_cache()
+def fetch_dashboard(period="week", limit=10):
+    response = SESSION.get(f"{API_URL}/dashboard", params={"period": period, "limit": limit}, timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.json()
 
 @st.cache_data(ttl=60)
-def fetch_leaderboard(period="week", limit=10):
-    try:
-        response = requests.get(f"{API_URL}/leaderboard", params={"period": period, "limit": limit})
-        return response.json()
-    except Exception as e:
-        st.error(f"Error fetching leaderboard: {e}")
-        return []
+def build_weekly_fig(weekly_data):
+    # Keyed on the data itself, so unchanged activity skips Plotly's figure build
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=weekly_data['Day'], y=weekly_data['Pages'], name='Pages Read'))
+    fig.add_trace(go.Scatter(x=weekly_data['Day'], y=weekly_data['Users'], name='Active Users', yaxis='y2'))
+    fig.update_layout(yaxis=dict(title='Pages'), yaxis2=dict(title='Users', overlaying='y', side='right'))
+    return fig
 
-def fetch_weekly_activity():
+@st.cache_data(ttl=30)
+def fetch_announcements():
     try:
-        response = requests.get(f"{API_URL}/activity/weekly")
-        return pd.DataFrame(response.json())
+        response = SESSION.get(f"{API_URL}/announcements", timeout=TIMEOUT)
+        return response.json() or []
     except Exception as e:
-        st.error(f"Error fetching weekly activity: {e}")
-        return pd.DataFrame()
+        st.error(f"Error fetching announcements: {e}")
+        return []
 
 def send_announcement(message, message_type, target_audience, pin_message, notify_all):
     try:
@@ -82,18 +189,20 @@ def send_announcement(message, message_type, target_audience, pin_message, notif
             "pin_message": pin_message,
             "notify_all": notify_all
         }
-        response = requests.post(f"{API_URL}/announcements", json=data, params={"admin_id": 1})
+        response = SESSION.post(f"{API_URL}/announcements", json=data, params={"admin_id": 1}, timeout=TIMEOUT)
+        response.raise_for_status()
         return response.json()
     except Exception as e:
         st.error(f"Error sending announcement: {e}")
         return None
 
 def update_user_status(user_id, status):
+    # Runs in worker threads (no script context): no st.* calls here, None means failed
     try:
-        response = requests.put(f"{API_URL}/users/{user_id}/status", params={"status": status})
+        response = SESSION.put(f"{API_URL}/users/{user_id}/status", params={"status": status}, timeout=TIMEOUT)
+        response.raise_for_status()
         return response.json()
-    except Exception as e:
-        st.error(f"Error updating user: {e}")
+    except Exception:
         return None
 
 # =============================================================================
@@ -109,7 +218,17 @@ page = st.sidebar.radio("Navigation", ["📊 Dashboard", "👥 Users", "📢 Ann
 
 if page == "📊 Dashboard":
     st.markdown('<p class="main-header">📊 Dashboard</p>', unsafe_allow_html=True)
-    stats = fetch_stats()
+    # Background tab: re-render the last data instead of hitting the API
+    hidden = st_javascript("document.hidden")
+    if hidden is True and "last_dashboard" in st.session_state:
+        dashboard = st.session_state["last_dashboard"]
+    else:
+        dashboard = fetch_dashboard(period="week", limit=10) or {}
+        if dashboard:
+            st.session_state["last_dashboard"] = dashboard
+    stats = dashboard.get("stats")
+    weekly_data = pd.DataFrame(dashboard.get("weekly", {}))
+    leaderboard = dashboard.get("leaderboard", [])
 
     if stats:
         col1, col2, col3, col4 = st.columns(4)
@@ -135,22 +254,15 @@ if page == "📊 Dashboard":
 
         # Weekly Activity Chart
         st.subheader("📈 Weekly Activity")
-        weekly_data = fetch_weekly_activity()
         if not weekly_data.empty:
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(x=weekly_data['Day'], y=weekly_data['Pages'], name='Pages Read'))
-            fig.add_trace(go.Scatter(x=weekly_data['Day'], y=weekly_data['Users'], name='Active Users', yaxis='y2'))
-            fig.update_layout(yaxis=dict(title='Pages'), yaxis2=dict(title='Users', overlaying='y', side='right'))
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(build_weekly_fig(weekly_data), use_container_width=True)
 
         # Leaderboard
         st.subheader("🏆 Top Readers This Week")
-        leaderboard = fetch_leaderboard(period="week", limit=10)
         if leaderboard:
             df_leaderboard = pd.DataFrame(leaderboard)
-            df_leaderboard['Medal'] = df_leaderboard['rank'].apply(
-                lambda x: '🥇' if x == 1 else '🥈' if x == 2 else '🥉' if x == 3 else ''
-            )
+            ranks = df_leaderboard['rank'].to_numpy()
+            df_leaderboard['Medal'] = np.select([ranks == 1, ranks == 2, ranks == 3], ['🥇', '🥈', '🥉'], default='')
             # ensure 'books' column exists
             if 'books' not in df_leaderboard.columns:
                 df_leaderboard['books'] = 0
@@ -164,15 +276,34 @@ if page == "📊 Dashboard":
 
 elif page == "👥 Users":
     st.markdown('<p class="main-header">👥 User Management</p>', unsafe_allow_html=True)
-    users = fetch_users()
+    col1, col2 = st.columns(2)
+    with col1:
+        page_size = st.selectbox("Rows", [25, 50, 100], index=0)
+    with col2:
+        page_num = st.number_input("Page", min_value=1, step=1)
+    users, total_users = fetch_users(page=page_num, page_size=page_size)
+    st.caption(f"Page {page_num} of {max(1, -(-total_users // page_size))} · {total_users} users")
     if users:
-        for user in users:
-            with st.expander(f"👤 {user['first_name']} (@{user.get('username','N/A')}) - {user['total_pages']} pages"):
-                st.write(f"ID: {user['id']} | Telegram: {user['telegram_id']} | Status: {user['status']}")
-                new_status = st.selectbox("Change Status", ["active","admin","banned"], key=f"status_{user['id']}")
-                if st.button("💾 Update", key=f"update_{user['id']}"):
-                    update_user_status(user['id'], new_status)
-                    st.success("✅ Status updated!")
+        # One editable table instead of an expander + widgets per user
+        df_users = pd.DataFrame(users, columns=["id", "first_name", "username", "status", "total_pages"])
+        edited = st.data_editor(
+            df_users,
+            column_config={"status": st.column_config.SelectboxColumn("status", options=["active", "admin", "banned"], required=True)},
+            disabled=["id", "first_name", "username", "total_pages"],
+            hide_index=True,
+            use_container_width=True,
+            key="users_editor"
+        )
+        changed = edited[edited["status"] != df_users["status"]]
+        if not changed.empty and st.button(f"💾 Update {len(changed)} user(s)"):
+            with ThreadPoolExecutor(max_workers=4) as ex:
+                results = list(ex.map(update_user_status, changed["id"].tolist(), changed["status"].tolist()))
+            fetch_users.clear()
+            failed = [user_id for user_id, r in zip(changed["id"].tolist(), results) if r is None]
+            if failed:
+                st.error(f"❌ {len(failed)} update(s) failed (user id: {', '.join(map(str, failed))})")
+            else:
+                st.success("✅ Status updated!")
 
 # =============================================================================
 # PAGE: ANNOUNCEMENTS
@@ -182,17 +313,14 @@ elif page == "📢 Announcements":
     st.markdown('<p class="main-header">📢 Announcements</p>', unsafe_allow_html=True)
     message = st.text_area("Message")
     if st.button("📤 Send Announcement"):
-        send_announcement(message, "general", "all", False, True)   
-        st.success("✅ Announcement sent!")
+        if send_announcement(message, "general", "all", False, True):
+            fetch_announcements.clear()
+            st.success("✅ Announcement queued! The bot will deliver it within a minute.")
 
     st.subheader("📜 Recent Announcements")
-    announcements = requests.get(f"{API_URL}/announcements").json()
+    announcements = fetch_announcements()
     for ann in announcements:
-        try:
-            created = datetime.fromisoformat(ann['created_at']).strftime("%Y-%m-%d")
-        except Exception:
-            created = ann['created_at'][:10]
-        st.write(f"📅 {created} - {ann['message']}")
+        st.write(f"📅 {ann['created_at']} - {ann['message']}")
 
 # =============================================================================
 # PAGE: SETTINGS
@@ -3,12 +3,16 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 import asyncio
 import aiohttp
+import threading
 
 # Configuration
 st.set_page_config(
@@ -21,6 +25,55 @@ st.set_page_config(
 # API Configuration
 API_URL = "http://localhost:8000/api"
 
+TIMEOUT = (2, 5)  # (connect, read) seconds
+
+@st.cache_resource
+def get_session():
+    """Shared HTTP session (keep-alive pool survives Streamlit reruns)"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=Retry(total=2, backoff_factor=0.2))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+SESSION = get_session()
+
+@st.cache_resource
+def get_event_loop():
+    """Long-lived event loop in a daemon thread (aiohttp sessions are bound to one loop)"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def run_async(coro):
+    """Run a coroutine on the shared loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+@st.cache_resource
+def get_aiohttp_session():
+    """Shared aiohttp session with a keep-alive connection pool"""
+    async def create():
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=5)
+        )
+    return run_async(create())
+
+# Announcement form: display names -> API values
+TYPE_MAP = {
+    "General Announcement": "general",
+    "Weekly Reminder": "reminder",
+    "Challenge Notification": "challenge",
+    "Achievement Alert": "achievement"
+}
+
+AUDIENCE_MAP = {
+    "All Users": "all",
+    "Active Users Only": "active",
+    "Top 10 Readers": "top10",
+    "Inactive Users (7+ days)": "inactive"
+}
+
 # Custom CSS for better styling
 st.markdown("""
 <style>
@@ -52,15 +105,10 @@ st.markdown("""
 # HELPER FUNCTIONS
 # =============================================================================
 
-@st.cache_data(ttl=60)
-def fetch_stats():
+async def fetch_stats(session):
     """Fetch overall statistics"""
-    try:
-        response = requests.get(f"{API_URL}/stats")
-        return response.json()
-    except Exception as e:
-        st.error(f"Error fetching stats: {e}")
-        return None
+    async with session.get(f"{API_URL}/stats", params={"cached": 1}) as response:
+        return await response.json()
 
 @st.cache_data(ttl=60)
 def fetch_users(search="", status="", limit=100):
@@ -71,31 +119,70 @@ def fetch_users(search="", status="", limit=100):
             params["search"] = search
         if status:
             params["status"] = status
-        response = requests.get(f"{API_URL}/users", params=params)
+        response = SESSION.get(f"{API_URL}/users", params=params, timeout=TIMEOUT)
         return response.json()
     except Exception as e:
         st.error(f"Error fetching users: {e}")
         return []
 
-@st.cache_data(ttl=60)
-def fetch_leaderboard(period="week", limit=10):
+async def fetch_leaderboard(session, period="week", limit=10):
     """Fetch leaderboard"""
-    try:
-        response = requests.get(f"{API_URL}/leaderboard", params={"period": period, "limit": limit})
-        return response.json()
-    except Exception as e:
-        st.error(f"Error fetching leaderboard: {e}")
-        return []
+    async with session.get(f"{API_URL}/leaderboard", params={"period": period, "limit": limit}) as response:
+        return await response.json()
+
+async def fetch_weekly_activity(session):
+    """Fetch weekly activity data"""
+    async with session.get(f"{API_URL}/activity/weekly") as response:
+        return pd.DataFrame(await response.json())
+
+@st.cache_data(ttl=60)
+def fetch_dashboard():
+    """Fetch stats, weekly activity and leaderboard concurrently"""
+    async def gather(session):
+        return await asyncio.gather(
+            fetch_stats(session),
+            fetch_weekly_activity(session),
+            fetch_leaderboard(session, period="week", limit=10),
+            return_exceptions=True
+        )
 
-def fetch_weekly_activity():
-    """Fetch weekly activity data (mock for now)"""
-    # In real implementation, add this endpoint to your API
-    days = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-    return pd.DataFrame({
-        'Day': days,
-        'Pages': [15420, 18930, 16540, 19870, 21340, 17650, 15680],
-        'Users': [245, 289, 267, 301, 325, 278, 251]
-    })
+    stats, weekly_data, leaderboard = run_async(gather(get_aiohttp_session()))
+    if isinstance(stats, Exception):
+        st.error(f"Error fetching stats: {stats}")
+        stats = None
+    if isinstance(weekly_data, Exception):
+        st.error(f"Error fetching weekly activity: {weekly_data}")
+        weekly_data = pd.DataFrame()
+    if isinstance(leaderboard, Exception):
+        st.error(f"Error fetching leaderboard: {leaderboard}")
+        leaderboard = []
+    return stats, weekly_data, leaderboard
+
+@st.cache_data(ttl=60)
+def build_weekly_fig(weekly_data):
+    """Build the weekly activity chart (cached on the data, skips Plotly rebuilds)"""
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=weekly_data['Day'],
+        y=weekly_data['Pages'],
+        name='Pages Read',
+        line=dict(color='#8b5cf6', width=3)
+    ))
+    fig.add_trace(go.Scatter(
+        x=weekly_data['Day'],
+        y=weekly_data['Users'],
+        name='Active Users',
+        line=dict(color='#10b981', width=3),
+        yaxis='y2'
+    ))
+    
+    fig.update_layout(
+        yaxis=dict(title='Pages'),
+        yaxis2=dict(title='Users', overlaying='y', side='right'),
+        hovermode='x unified',
+        height=350
+    )
+    return fig
 
 def send_announcement(message, message_type, target_audience, pin_message, notify_all):
     """Send announcement via API"""
@@ -107,7 +194,7 @@ def send_announcement(message, message_type, target_audience, pin_message, notif
             "pin_message": pin_message,
             "notify_all": notify_all
         }
-        response = requests.post(f"{API_URL}/announcements", json=data, params={"admin_id": 1})
+        response = SESSION.post(f"{API_URL}/announcements", json=data, params={"admin_id": 1}, timeout=TIMEOUT)
         return response.json()
     except Exception as e:
         st.error(f"Error sending announcement: {e}")
@@ -116,7 +203,7 @@ def send_announcement(message, message_type, target_audience, pin_message, notif
 def update_user_status(user_id, status):
     """Update user status"""
     try:
-        response = requests.put(f"{API_URL}/users/{user_id}/status", params={"status": status})
+        response = SESSION.put(f"{API_URL}/users/{user_id}/status", params={"status": status}, timeout=TIMEOUT)
         return response.json()
     except Exception as e:
         st.error(f"Error updating user: {e}")
@@ -148,7 +235,7 @@ if page == "📊 Dashboard":
     st.markdown('<p class="main-header">📊 Dashboard</p>', unsafe_allow_html=True)
     
     # Fetch data
-    stats = fetch_stats()
+    stats, weekly_data, leaderboard = fetch_dashboard()
     
     if stats:
         # Statistics Cards
@@ -189,30 +276,8 @@ if page == "📊 Dashboard":
         
         with col1:
             st.subheader("📈 Weekly Activity")
-            weekly_data = fetch_weekly_activity()
-            
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(
-                x=weekly_data['Day'],
-                y=weekly_data['Pages'],
-                name='Pages Read',
-                line=dict(color='#8b5cf6', width=3)
-            ))
-            fig.add_trace(go.Scatter(
-                x=weekly_data['Day'],
-                y=weekly_data['Users'],
-                name='Active Users',
-                line=dict(color='#10b981', width=3),
-                yaxis='y2'
-            ))
-            
-            fig.update_layout(
-                yaxis=dict(title='Pages'),
-                yaxis2=dict(title='Users', overlaying='y', side='right'),
-                hovermode='x unified',
-                height=350
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            if not weekly_data.empty:
+                st.plotly_chart(build_weekly_fig(weekly_data), use_container_width=True)
         
         with col2:
             st.subheader("📚 Book Categories")
@@ -234,16 +299,14 @@ if page == "📊 Dashboard":
         
         # Leaderboard
         st.subheader("🏆 Top Readers This Week")
-        leaderboard = fetch_leaderboard(period="week", limit=10)
         
         if leaderboard:
             # Create DataFrame
             df_leaderboard = pd.DataFrame(leaderboard)
             
             # Add medal emojis
-            df_leaderboard['Medal'] = df_leaderboard['rank'].apply(
-                lambda x: '🥇' if x == 1 else '🥈' if x == 2 else '🥉' if x == 3 else ''
-            )
+            ranks = df_leaderboard['rank'].to_numpy()
+            df_leaderboard['Medal'] = np.select([ranks == 1, ranks == 2, ranks == 3], ['🥇', '🥈', '🥉'], default='')
             
             # Reorder columns
             df_leaderboard = df_leaderboard[['Medal', 'rank', 'name', 'pages', 'books']]
@@ -275,7 +338,7 @@ elif page == "👥 Users":
         st.write("")  # Spacing
         st.write("")
         if st.button("🔄 Refresh", use_container_width=True):
-            st.cache_data.clear()
+            fetch_users.clear()
             st.rerun()
     
     # Fetch users
@@ -297,7 +360,7 @@ elif page == "👥 Users":
                     st.write(f"**User ID:** {user['id']}")
                     st.write(f"**Telegram ID:** {user['telegram_id']}")
                     st.write(f"**Status:** {user['status']}")
-                    st.write(f"**Joined:** {user['join_date'][:10]}")
+                    st.write(f"**Joined:** {user['join_date']}")
                 
                 with col2:
                     st.write(f"**📖 Total Pages:** {user['total_pages']}")
@@ -318,7 +381,7 @@ elif page == "👥 Users":
                         result = update_user_status(user['id'], new_status)
                         if result:
                             st.success("✅ Status updated!")
-                            st.cache_data.clear()
+                            fetch_users.clear()
                             st.rerun()
                     
                     if st.button("📩 Message", key=f"msg_{user['id']}"):
@@ -349,16 +412,10 @@ elif page == "📢 Announcements":
         col1, col2 = st.columns(2)
         
         with col1:
-            message_type = st.selectbox(
-                "Message Type",
-                ["General Announcement", "Weekly Reminder", "Challenge Notification", "Achievement Alert"]
-            )
+            message_type = st.selectbox("Message Type", list(TYPE_MAP))
         
         with col2:
-            target_audience = st.selectbox(
-                "Target Audience",
-                ["All Users", "Active Users Only", "Top 10 Readers", "Inactive Users (7+ days)"]
-            )
+            target_audience = st.selectbox("Target Audience", list(AUDIENCE_MAP))
         
         message = st.text_area(
             "Message",
@@ -385,31 +442,16 @@ elif page == "📢 Announcements":
         
         if submitted:
             if message.strip():
-                # Convert display names to API values
-                type_map = {
-                    "General Announcement": "general",
-                    "Weekly Reminder": "reminder",
-                    "Challenge Notification": "challenge",
-                    "Achievement Alert": "achievement"
-                }
-                
-                audience_map = {
-                    "All Users": "all",
-                    "Active Users Only": "active",
-                    "Top 10 Readers": "top10",
-                    "Inactive Users (7+ days)": "inactive"
-                }
-                
                 result = send_announcement(
                     message=message,
-                    message_type=type_map[message_type],
-                    target_audience=audience_map[target_audience],
+                    message_type=TYPE_MAP[message_type],
+                    target_audience=AUDIENCE_MAP[target_audience],
                     pin_message=pin_message,
                     notify_all=notify_all
                 )
                 
                 if result:
-                    st.success("✅ Announcement sent successfully!")
+                    st.success("✅ Announcement queued! The bot will deliver it within a minute.")
                     st.balloons()
             else:
                 st.error("❌ Message cannot be empty!")
@@ -1,10 +1,21 @@
-from fastapi import FastAPI, HTTPException, Depends, Query
+from fastapi import FastAPI, HTTPException, Depends, Query, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, func, or_
-from sqlalchemy.orm import declarative_base, Session, sessionmaker
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import event, select, insert, update, delete, literal, case, type_coerce, Boolean, Column, Integer, BigInteger, String, Date, DateTime, ForeignKey, Index, func, or_, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.schema import CreateIndex
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import hashlib
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel
+from pydantic import BaseModel, field_serializer
+from cachetools import TTLCache
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+import orjson
 
 # ==============================
 # BASE
@@ -17,14 +28,14 @@ Base = declarative_base()
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
-    telegram_id = Column(Integer, unique=True, index=True)
+    telegram_id = Column(BigInteger, unique=True, index=True, nullable=False)
     username = Column(String, nullable=True)
     first_name = Column(String)
     last_name = Column(String, nullable=True)
     status = Column(String, default="active")  # active/admin/banned
     daily_goal = Column(Integer, default=50)
     monthly_goal = Column(Integer, default=1500)
-    reminder_time = Column(String, default="20:00")  # HH:MM local time
+    reminder_time = Column(String, default="20:00", index=True)  # HH:MM local time
     timezone = Column(String, default="GMT+5")
     current_streak = Column(Integer, default=0)
     longest_streak = Column(Integer, default=0)
@@ -33,13 +44,21 @@ class User(Base):
     join_date = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     last_active = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
+# Case-insensitive search on /api/users
+Index("ix_users_first_name_lower", func.lower(User.first_name))
+Index("ix_users_username_lower", func.lower(User.username))
+
 class ReadingLog(Base):
     __tablename__ = "reading_logs"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    date = Column(DateTime, index=True)
+    date = Column(Date)  # calendar day; plain comparisons can use the indexes
     pages = Column(Integer)
 
+# Leaderboard/report aggregations (by user) and weekly activity (by date)
+Index("ix_logs_user_date", ReadingLog.user_id, ReadingLog.date)
+Index("ix_logs_date_user", ReadingLog.date, ReadingLog.user_id)
+
 class Announcement(Base):
     __tablename__ = "announcements"
     id = Column(Integer, primary_key=True, index=True)
@@ -51,6 +70,23 @@ class Announcement(Base):
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     sent_at = Column(DateTime, nullable=True)     # ✅ yangi ustun
 
+class DailyActivity(Base):
+    """Per-day rollup of reading_logs, rebuilt by the scheduler (see _refresh_daily_activity)."""
+    __tablename__ = "daily_activity"
+    day = Column(Date, primary_key=True)
+    pages = Column(Integer, default=0)
+    users = Column(Integer, default=0)
+
+class LeaderboardCache(Base):
+    """Ranked pages per user for each period ("week", "month", "all"), rebuilt by refresh_leaderboards."""
+    __tablename__ = "leaderboard_cache"
+    period = Column(String, primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    user_id = Column(Integer)
+    name = Column(String)
+    pages = Column(Integer)
+    books = Column(Integer)
+
 # ==============================
 # PYDANTIC MODELS
 # ==============================
@@ -68,11 +104,28 @@ class UserResponse(BaseModel):
     status: str
     total_pages: int
     current_streak: int
+    longest_streak: int
     books_completed: int
     join_date: datetime
     class Config:
         from_attributes = True
 
+    @field_serializer("join_date")
+    def _format_join_date(self, value: datetime):
+        return value.strftime("%Y-%m-%d")
+
+class AnnouncementResponse(BaseModel):
+    id: int
+    message: str
+    created_at: datetime
+    sent_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
+
+    @field_serializer("created_at")
+    def _format_created_at(self, value: datetime):
+        return value.strftime("%Y-%m-%d")
+
 class ReadingLogCreate(BaseModel):
     date: datetime
     pages: int
@@ -90,45 +143,121 @@ class UpdateFields(BaseModel):
 # ==============================
 # DATABASE SETUP
 # ==============================
-DATABASE_URL = "sqlite:///./mutolaa.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base.metadata.create_all(bind=engine)
+DATABASE_URL = "sqlite+aiosqlite:///./mutolaa.db"
+engine = create_async_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": 15},
+    # aiosqlite defaults to NullPool (a new connection per checkout); keep connections pooled
+    poolclass=AsyncAdaptedQueuePool,
+    pool_pre_ping=True,
+    pool_size=20,
+    max_overflow=40,
+    pool_recycle=3600
+)
 
-def get_db():
-    db = SessionLocal()
-    try:
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _):
+    # WAL lets the admin panel's reads run alongside the bot's writes
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+# expire_on_commit=False: attributes stay readable after commit without a lazy (sync) reload
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        # create_all() skips indexes on tables that already exist, so add new ones explicitly
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                await conn.execute(CreateIndex(index, if_not_exists=True))
+        # Superseded by ix_logs_date_user, whose leading column serves the same date scans
+        await conn.execute(text("DROP INDEX IF EXISTS ix_reading_logs_date"))
+        # reading_logs.date used to hold full timestamps; normalise old rows to plain dates
+        await conn.execute(
+            update(ReadingLog).where(func.length(ReadingLog.date) > 10).values(date=func.date(ReadingLog.date))
+        )
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 # ==============================
 # FASTAPI APP
 # ==============================
-app = FastAPI(title="Mutolaa Bot API", version="1.2.0")
+app = FastAPI(title="Mutolaa Bot API", version="1.2.0", default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "ETag"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
+# ==============================
+# SCHEDULER
+# ==============================
+scheduler = AsyncIOScheduler()
+
+@app.on_event("startup")
+async def startup():
+    await init_db()
+    await _refresh_daily_activity()
+    await refresh_leaderboards()
+    await expire_streaks()
+    scheduler.add_job(_refresh_daily_activity, "interval", seconds=60, id="daily_activity", replace_existing=True)
+    scheduler.add_job(refresh_leaderboards, "interval", seconds=60, id="leaderboards", replace_existing=True)
+    scheduler.add_job(expire_streaks, "cron", hour=0, minute=0, id="expire_streaks", replace_existing=True)
+    scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    scheduler.shutdown(wait=False)
+    await engine.dispose()
 
 # ==============================
 # HELPERS
 # ==============================
-def get_month_range(dt: datetime):
-    start = dt.replace(day=1)
+# Windows only change at midnight, so they are memoized per calendar day (ordinal)
+@lru_cache(maxsize=8)
+def _month_range(ordinal: int):
+    start = datetime.fromordinal(ordinal).date().replace(day=1)
     next_month = (start + timedelta(days=32)).replace(day=1)
     end = next_month - timedelta(days=1)
-    return start.date(), end.date()
+    return start, end
 
-def get_week_saturday_to_friday(today: datetime):
+@lru_cache(maxsize=8)
+def _week_range(ordinal: int):
+    today = datetime.fromordinal(ordinal).date()
     delta_to_saturday = (today.weekday() - 5) % 7
-    start = (today - timedelta(days=delta_to_saturday)).date()
+    start = today - timedelta(days=delta_to_saturday)
     end = start + timedelta(days=6)
     return start, end
 
+def get_month_range(dt: datetime):
+    return _month_range(dt.toordinal())
+
+def get_week_saturday_to_friday(today: datetime):
+    return _week_range(today.toordinal())
+
+def compute_streaks(days, today):
+    """(current, longest) run of consecutive days in an ascending list of distinct dates.
+    The current streak survives until the end of the day after the last log."""
+    longest = run = 0
+    prev = None
+    for day in days:
+        run = run + 1 if prev is not None and (day - prev).days == 1 else 1
+        longest = max(longest, run)
+        prev = day
+    current = run if prev is not None and (today - prev).days <= 1 else 0
+    return current, longest
+
 # ==============================
 # ROOT
 # ==============================
@@ -139,240 +268,332 @@ async def root():
 # ==============================
 # USERS
 # ==============================
-@app.post("/api/users", response_model=UserResponse)
-async def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.telegram_id == user.telegram_id).first()
-    if existing:
-        return existing
-    new_user = User(
-        telegram_id=user.telegram_id,
-        username=user.username,
-        first_name=user.first_name,
-        last_name=user.last_name
+# list_users pages keyed by query args; cleared by every write that touches users
+_users_cache = TTLCache(maxsize=32, ttl=30)
+
+def _invalidate_users():
+    _users_cache.clear()
+
+async def _user_id(db: AsyncSession, telegram_id: int) -> int:
+    """Resolve telegram_id to users.id from the telegram_id index alone; 404 if unknown."""
+    user_id = (await db.execute(select(User.id).where(User.telegram_id == telegram_id))).scalar_one_or_none()
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_id
+
+@app.post("/api/users", response_model=UserResponse, response_model_exclude_none=True)
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    # One atomic upsert: concurrent /start calls can't race, and a returning
+    # user's username/first_name are refreshed from Telegram
+    stmt = (
+        sqlite_insert(User)
+        .values(
+            telegram_id=user.telegram_id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name
+        )
+        .on_conflict_do_update(
+            index_elements=[User.telegram_id],
+            set_={"username": user.username, "first_name": user.first_name}
+        )
+        .returning(User)
     )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return new_user
-
-@app.get("/api/users/by-telegram/{telegram_id}", response_model=UserResponse)
-async def get_user_by_telegram(telegram_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    db_user = (await db.execute(stmt)).scalar_one()
+    await db.commit()
+    _invalidate_users()
+    return db_user
+
+@app.get("/api/users/by-telegram/{telegram_id}", response_model=UserResponse, response_model_exclude_none=True)
+async def get_user_by_telegram(telegram_id: int, db: AsyncSession = Depends(get_db)):
+    user = (await db.execute(select(User).where(User.telegram_id == telegram_id))).scalar_one_or_none()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 @app.put("/api/users/{telegram_id}/update")
-async def update_user_fields(telegram_id: int, fields: UpdateFields, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
-    if not user:
+async def update_user_fields(telegram_id: int, fields: UpdateFields, db: AsyncSession = Depends(get_db)):
+    data = {key: value for key, value in fields.dict(exclude_unset=True).items() if value is not None}
+    if not data:
+        await _user_id(db, telegram_id)
+        return {"message": "User updated"}
+    result = await db.execute(update(User).where(User.telegram_id == telegram_id).values(**data))
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="User not found")
-    data = fields.dict(exclude_unset=True)
-    for key, value in data.items():
-        if hasattr(user, key) and value is not None:
-            setattr(user, key, value)
-    db.commit()
+    await db.commit()
+    _invalidate_users()
     return {"message": "User updated"}
 
-@app.get("/api/users")
+@app.get("/api/users", response_model=List[UserResponse], response_model_exclude_none=True)
 async def list_users(
+    response: Response,
     search: str = "",
     status: str = "",
+    offset: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
 ):
-    q = db.query(User)
-    if search:
-        q = q.filter(or_(User.first_name.contains(search), User.username.contains(search)))
-    if status:
-        q = q.filter(User.status == status)
-    users = q.order_by(User.id.desc()).limit(limit).all()
-    return [
-        {
-            "id": u.id,
-            "telegram_id": u.telegram_id,
-            "username": u.username,
-            "first_name": u.first_name,
-            "status": u.status,
-            "total_pages": u.total_pages
-        } for u in users
-    ]
+    key = (search, status, offset, limit)
+    cached = _users_cache.get(key)
+    if cached is None:
+        q = select(User)
+        if search:
+            pattern = f"%{search}%"
+            q = q.where(or_(User.first_name.ilike(pattern), User.username.ilike(pattern)))
+        if status:
+            q = q.where(User.status == status)
+        # Total matching rows, so paginated clients can size their pager without another call
+        total = (await db.execute(select(func.count()).select_from(q.subquery()))).scalar_one()
+        rows = (await db.execute(q.order_by(User.id.desc()).offset(offset).limit(limit))).scalars().all()
+        users = [UserResponse.model_validate(u) for u in rows]
+        body = orjson.dumps([total, [u.model_dump(mode="json") for u in users]])
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        cached = _users_cache[key] = (total, users, etag)
+    total, users, etag = cached
+    headers = {"X-Total-Count": str(total), "ETag": etag}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return users
 
 @app.put("/api/users/{user_id}/status")
 async def update_user_status(
     user_id: int,
     status: str = Query(..., description="New status: active/admin/banned"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     user.status = status
-    db.commit()
+    await db.commit()
+    _invalidate_users()
     return {"message": "Status updated"}
 
 @app.get("/api/users/need-reminder")
-async def get_users_need_reminder(db: Session = Depends(get_db)):
-    # Compare server local time HH:MM with reminder_time
-    now_hhmm = datetime.now().strftime("%H:%M")
-    users = db.query(User).filter(User.reminder_time == now_hhmm).all()
-    return [{"telegram_id": u.telegram_id, "first_name": u.first_name} for u in users]
+async def get_users_need_reminder(
+    at: Optional[str] = Query(None, pattern=r"^([01]\d|2[0-3]):[0-5]\d$", description="HH:MM bucket; defaults to server local time"),
+    db: AsyncSession = Depends(get_db)
+):
+    # The bot's cron jobs pass their own bucket, so a late run or a clock/timezone
+    # mismatch between bot and API can't skip it
+    hhmm = at or datetime.now().strftime("%H:%M")
+    rows = await db.execute(
+        select(User.telegram_id, User.first_name).where(User.reminder_time == hhmm)
+    )
+    return rows.mappings().all()
+
+@app.get("/api/users/recipients")
+async def stream_recipients():
+    """All users as JSON lines ({telegram_id, first_name}), streamed from a server-side cursor.
+    Used for broadcasts, so memory stays flat however many users there are."""
+    async def lines():
+        async with SessionLocal() as db:
+            result = await db.stream(
+                select(User.telegram_id, User.first_name).execution_options(yield_per=200)
+            )
+            async for row in result.mappings():
+                yield orjson.dumps(dict(row)) + b"\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/api/users/reminder-times")
+async def get_reminder_times(db: AsyncSession = Depends(get_db)):
+    # Distinct HH:MM buckets; the bot schedules one cron job per bucket
+    rows = await db.execute(
+        select(User.reminder_time).where(User.reminder_time.is_not(None)).distinct()
+    )
+    return rows.scalars().all()
 # ==============================
 # READING LOGS
 # ==============================
+async def _update_streaks(db: AsyncSession, user_id: int):
+    await db.flush()
+    days = (await db.execute(
+        select(ReadingLog.date).where(ReadingLog.user_id == user_id).distinct().order_by(ReadingLog.date)
+    )).scalars().all()
+    current, longest = compute_streaks(days, datetime.now().date())
+    await db.execute(
+        update(User).where(User.id == user_id).values(current_streak=current, longest_streak=longest)
+    )
+    return current, longest
+
+async def expire_streaks():
+    """Zero current_streak for users with no log today or yesterday.
+    Streaks are only recomputed on writes, so inactive users would otherwise keep theirs."""
+    yesterday = datetime.now().date() - timedelta(days=1)
+    recent = select(ReadingLog.user_id).where(ReadingLog.date >= yesterday, ReadingLog.user_id.is_not(None))
+    async with SessionLocal() as db:
+        result = await db.execute(
+            update(User).where(User.current_streak > 0, User.id.not_in(recent))
+            .values(current_streak=0)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    if result.rowcount:
+        _invalidate_users()
+
 @app.post("/api/reading-logs")
-async def create_reading_log(log: ReadingLogCreate, telegram_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    new_log = ReadingLog(user_id=user.id, date=log.date, pages=log.pages)
+async def create_reading_log(log: ReadingLogCreate, telegram_id: int, db: AsyncSession = Depends(get_db)):
+    user_id = await _user_id(db, telegram_id)
+    new_log = ReadingLog(user_id=user_id, date=log.date.date(), pages=log.pages)
     db.add(new_log)
-    user.total_pages += log.pages
-    user.last_active = datetime.now(timezone.utc)
-    # streak calculation (simplified): if log for today exists, increment current_streak else reset
-    # Optional: implement advanced streak logic here
-    db.commit()
-    return {"message": "Reading log created", "pages": log.pages, "total_pages": user.total_pages}
+    # Increment in SQL so concurrent writes for the same user can't lose pages
+    total_pages = (await db.execute(
+        update(User).where(User.id == user_id)
+        .values(total_pages=User.total_pages + log.pages, last_active=datetime.now(timezone.utc))
+        .returning(User.total_pages)
+    )).scalar_one()
+    current_streak, _ = await _update_streaks(db, user_id)
+    await db.commit()
+    _invalidate_users()
+    return {"message": "Reading log created", "pages": log.pages, "total_pages": total_pages, "current_streak": current_streak}
 
 @app.put("/api/reading-logs/{date}")
-async def update_reading_log(date: str, update: ReadingLogUpdate, telegram_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+async def update_reading_log(date: str, log_update: ReadingLogUpdate, telegram_id: int, db: AsyncSession = Depends(get_db)):
+    user_id = await _user_id(db, telegram_id)
     log_date = datetime.strptime(date, "%Y-%m-%d").date()
-    log = db.query(ReadingLog).filter(ReadingLog.user_id == user.id, func.date(ReadingLog.date) == log_date).first()
+    log = (await db.execute(
+        select(ReadingLog).where(ReadingLog.user_id == user_id, ReadingLog.date == log_date).limit(1)
+    )).scalar_one_or_none()
     if not log:
         raise HTTPException(status_code=404, detail="Log not found")
-    user.total_pages = user.total_pages - log.pages + update.pages
-    log.pages = update.pages
-    db.commit()
-    return {"message": "Reading log updated", "pages": update.pages}
+    await db.execute(
+        update(User).where(User.id == user_id)
+        .values(total_pages=User.total_pages + (log_update.pages - log.pages))
+    )
+    log.pages = log_update.pages
+    await db.commit()
+    _invalidate_users()
+    return {"message": "Reading log updated", "pages": log_update.pages}
 
 @app.delete("/api/reading-logs/{date}")
-async def delete_reading_log(date: str, telegram_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+async def delete_reading_log(date: str, telegram_id: int, db: AsyncSession = Depends(get_db)):
+    user_id = await _user_id(db, telegram_id)
     log_date = datetime.strptime(date, "%Y-%m-%d").date()
-    log = db.query(ReadingLog).filter(ReadingLog.user_id == user.id, func.date(ReadingLog.date) == log_date).first()
+    log = (await db.execute(
+        select(ReadingLog).where(ReadingLog.user_id == user_id, ReadingLog.date == log_date).limit(1)
+    )).scalar_one_or_none()
     if not log:
         raise HTTPException(status_code=404, detail="Log not found")
-    user.total_pages -= log.pages
-    db.delete(log)
-    db.commit()
+    await db.execute(
+        update(User).where(User.id == user_id).values(total_pages=User.total_pages - log.pages)
+    )
+    await db.delete(log)
+    await _update_streaks(db, user_id)
+    await db.commit()
+    _invalidate_users()
     return {"message": "Reading log deleted"}
 
 
 # ==============================
 # LEADERBOARD
 # ==============================
+async def refresh_leaderboards():
+    """Rebuild leaderboard_cache: one GROUP BY + ROW_NUMBER() per period, ranked inside SQLite."""
+    today = datetime.now()
+    windows = {
+        "week": get_week_saturday_to_friday(today),
+        "month": get_month_range(today),
+        "all": None
+    }
+    pages = func.sum(ReadingLog.pages)
+    async with SessionLocal() as db:
+        for period, window in windows.items():
+            ranked = (
+                select(
+                    literal(period),
+                    func.row_number().over(order_by=(pages.desc(), User.id)),
+                    User.id,
+                    User.first_name,
+                    pages,
+                    User.books_completed
+                )
+                .join(ReadingLog, User.id == ReadingLog.user_id)
+                .group_by(User.id)
+            )
+            if window:
+                ranked = ranked.where(ReadingLog.date >= window[0], ReadingLog.date <= window[1])
+            await db.execute(delete(LeaderboardCache).where(LeaderboardCache.period == period))
+            await db.execute(
+                insert(LeaderboardCache).from_select(["period", "rank", "user_id", "name", "pages", "books"], ranked)
+            )
+        await db.commit()
+
+CACHED_PAGES = func.coalesce(LeaderboardCache.pages, 0)
+
+async def _ranked_pages(db: AsyncSession, period: str, *extra, limit: Optional[int] = None):
+    """rank/name/pages rows (plus any extra labelled columns) for a cached period."""
+    q = (
+        select(LeaderboardCache.rank, LeaderboardCache.name, CACHED_PAGES.label("pages"), *extra)
+        .where(LeaderboardCache.period == period)
+        .order_by(LeaderboardCache.rank)
+    )
+    if limit is not None:
+        q = q.limit(limit)
+    return (await db.execute(q)).mappings().all()
+
+async def _leaderboard(db: AsyncSession, period: str, limit: int):
+    if period not in ("week", "month"):
+        period = "all"
+    return await _ranked_pages(db, period, func.coalesce(LeaderboardCache.books, 0).label("books"), limit=limit)
+
 @app.get("/api/leaderboard")
-async def leaderboard(period: str = "week", limit: int = 10, db: Session = Depends(get_db)):
+async def leaderboard(period: str = "week", limit: int = 10, db: AsyncSession = Depends(get_db)):
     """
     Returns a list of {rank, name, pages, books} for the selected period.
     - period: "week", "month", or "all"
     """
-    today = datetime.now()
-    if period == "week":
-        start_date, end_date = get_week_saturday_to_friday(today)
-        date_filter = (func.date(ReadingLog.date) >= start_date, func.date(ReadingLog.date) <= end_date)
-    elif period == "month":
-        start_date, end_date = get_month_range(today)
-        date_filter = (func.date(ReadingLog.date) >= start_date, func.date(ReadingLog.date) <= end_date)
-    else:
-        date_filter = None
-
-    q = db.query(
-        User.first_name.label("name"),
-        func.sum(ReadingLog.pages).label("pages"),
-        User.books_completed.label("books")
-    ).join(ReadingLog, User.id == ReadingLog.user_id)
-
-    if date_filter:
-        q = q.filter(*date_filter)
-
-    results = q.group_by(User.id).order_by(func.sum(ReadingLog.pages).desc()).limit(limit).all()
-
-    resp = []
-    for idx, row in enumerate(results, start=1):
-        # row may be tuple depending on SQLAlchemy version
-        name = row[0] if isinstance(row, tuple) else getattr(row, "name", "")
-        pages = int((row[1] if isinstance(row, tuple) else getattr(row, "pages", 0)) or 0)
-        books = int((row[2] if isinstance(row, tuple) else getattr(row, "books", 0)) or 0)
-        resp.append({"rank": idx, "name": name, "pages": pages, "books": books})
-    return resp
+    return await _leaderboard(db, period, limit)
 
 # ==============================
 # REPORTS
 # ==============================
 
 @app.get("/api/report/week")
-async def weekly_report(db: Session = Depends(get_db)):
+async def weekly_report(db: AsyncSession = Depends(get_db)):
     """
     Haftalik report (Shanba–Juma).
     Winner flag for users who read 500+ pages in the week.
     """
-    today = datetime.now()
-    start_date, end_date = get_week_saturday_to_friday(today)
-
-    results = (
-        db.query(User.first_name.label("name"), func.sum(ReadingLog.pages).label("pages"))
-        .join(ReadingLog, User.id == ReadingLog.user_id)
-        .filter(func.date(ReadingLog.date) >= start_date, func.date(ReadingLog.date) <= end_date)
-        .group_by(User.id)
-        .order_by(func.sum(ReadingLog.pages).desc())
-        .all()
-    )
-
-    report = []
-    for idx, row in enumerate(results, start=1):
-        name = row[0] if isinstance(row, tuple) else getattr(row, "name", "")
-        pages = int((row[1] if isinstance(row, tuple) else getattr(row, "pages", 0)) or 0)
-        report.append({"rank": idx, "name": name, "pages": pages, "winner": pages >= 500})
-    return report
+    return await _ranked_pages(db, "week", type_coerce(CACHED_PAGES >= 500, Boolean).label("winner"))
 
 @app.get("/api/report/month")
-async def monthly_report(db: Session = Depends(get_db)):
+async def monthly_report(db: AsyncSession = Depends(get_db)):
     """
     Oylik report (1-sanadan oxirgi sanagacha).
     """
-    today = datetime.now()
-    start_date, end_date = get_month_range(today)
-
-    results = (
-        db.query(User.first_name.label("name"), func.sum(ReadingLog.pages).label("pages"))
-        .join(ReadingLog, User.id == ReadingLog.user_id)
-        .filter(func.date(ReadingLog.date) >= start_date, func.date(ReadingLog.date) <= end_date)
-        .group_by(User.id)
-        .order_by(func.sum(ReadingLog.pages).desc())
-        .all()
-    )
-
-    report = []
-    for idx, row in enumerate(results, start=1):
-        name = row[0] if isinstance(row, tuple) else getattr(row, "name", "")
-        pages = int((row[1] if isinstance(row, tuple) else getattr(row, "pages", 0)) or 0)
-        report.append({"rank": idx, "name": name, "pages": pages})
-    return report
+    return await _ranked_pages(db, "month")
 
 
 # ==============================
 # STATS (ADMIN DASHBOARD)
 # ==============================
 
-@app.get("/api/stats")
-async def get_stats(db: Session = Depends(get_db)):
-    total_users = db.query(User).count()
-    active_today = db.query(User).filter(func.date(User.last_active) == datetime.now().date()).count()
-    total_pages = db.query(func.sum(User.total_pages)).scalar() or 0
-    books_completed = db.query(func.sum(User.books_completed)).scalar() or 0
-
-    one_week_ago = datetime.now() - timedelta(days=7)
-    new_users = db.query(User).filter(User.join_date >= one_week_ago).count()
+# Short-lived memo of the assembled stats dict for the admin panel (?cached=1)
+_stats_cache = TTLCache(maxsize=4, ttl=10)
+
+async def _compute_stats(db: AsyncSession):
+    now = datetime.now()
+    today = now.date()
+    one_week_ago = now - timedelta(days=7)
+    # All user-table figures in one scan via conditional aggregates
+    total_users, active_today, total_pages, books_completed, new_users = (await db.execute(
+        select(
+            func.count(User.id),
+            func.count(case((func.date(User.last_active) == today, 1))),
+            func.sum(User.total_pages),
+            func.sum(User.books_completed),
+            func.count(case((User.join_date >= one_week_ago, 1)))
+        )
+    )).one()
+    total_pages = total_pages or 0
     weekly_growth = (new_users / total_users * 100) if total_users > 0 else 0.0
 
-    seven_days_ago = datetime.now() - timedelta(days=7)
-    pages_last_week = db.query(func.sum(ReadingLog.pages)).filter(ReadingLog.date >= seven_days_ago).scalar() or 0
+    pages_last_week = (await db.execute(
+        # 7 calendar days, today included: the same window as the weekly activity chart
+        select(func.sum(ReadingLog.pages)).where(ReadingLog.date >= today - timedelta(days=6))
+    )).scalar() or 0
     avg_pages_per_day = (pages_last_week / 7.0) if pages_last_week else 0.0
 
     return {
@@ -384,28 +605,82 @@ async def get_stats(db: Session = Depends(get_db)):
         "books_completed": int(books_completed or 0)
     }
 
+async def _cached_stats(db: AsyncSession):
+    stats = _stats_cache.get("stats")
+    if stats is None:
+        stats = _stats_cache["stats"] = await _compute_stats(db)
+    return stats
+
+@app.get("/api/stats")
+async def get_stats(cached: bool = Query(False), db: AsyncSession = Depends(get_db)):
+    return await _cached_stats(db) if cached else await _compute_stats(db)
+
 # ==============================
 # WEEKLY ACTIVITY (ADMIN DASHBOARD)
 # ==============================
 
-@app.get("/api/activity/weekly")
-async def weekly_activity(db: Session = Depends(get_db)):
+ROLLUP_DAYS = 8  # rebuilt window; one day more than the chart shows
+
+async def _refresh_daily_activity():
+    start = datetime.now().date() - timedelta(days=ROLLUP_DAYS - 1)
+    async with SessionLocal() as db:
+        rows = (await db.execute(
+            select(ReadingLog.date, func.sum(ReadingLog.pages), func.count(func.distinct(ReadingLog.user_id)))
+            .where(ReadingLog.date >= start)
+            .group_by(ReadingLog.date)
+        )).all()
+        # Replace the whole window so days whose logs were deleted drop back to zero
+        await db.execute(delete(DailyActivity).where(DailyActivity.day >= start))
+        db.add_all(
+            DailyActivity(day=day, pages=int(pages or 0), users=int(users or 0))
+            for day, pages, users in rows
+        )
+        await db.commit()
+
+async def _weekly_activity(db: AsyncSession):
     today = datetime.now().date()
     start_date = today - timedelta(days=6)
-    data = []
+    rollup = {r.day: r for r in (await db.execute(select(DailyActivity).where(DailyActivity.day >= start_date))).scalars()}
+    # Column-oriented, so clients can wrap it in a DataFrame without per-row dicts
+    data = {"Day": [], "Pages": [], "Users": []}
     for i in range(7):
         day = start_date + timedelta(days=i)
-        pages = db.query(func.sum(ReadingLog.pages)).filter(func.date(ReadingLog.date) == day).scalar() or 0
-        users = db.query(ReadingLog.user_id).filter(func.date(ReadingLog.date) == day).distinct().count()
-        data.append({"Day": day.strftime("%a"), "Pages": int(pages), "Users": int(users)})
+        row = rollup.get(day)
+        data["Day"].append(day.strftime("%a"))
+        data["Pages"].append(row.pages if row else 0)
+        data["Users"].append(row.users if row else 0)
     return data
 
+@app.get("/api/activity/weekly")
+async def weekly_activity(db: AsyncSession = Depends(get_db)):
+    return await _weekly_activity(db)
+
+# ==============================
+# DASHBOARD BUNDLE (ADMIN DASHBOARD)
+# ==============================
+
+@app.get("/api/dashboard")
+async def dashboard(period: str = "week", limit: int = 10, db: AsyncSession = Depends(get_db)):
+    """
+    Stats, weekly activity and leaderboard in one response, so the admin
+    dashboard needs a single round-trip per refresh.
+    """
+    return {
+        "stats": await _cached_stats(db),
+        "weekly": await _weekly_activity(db),
+        "leaderboard": await _leaderboard(db, period, limit)
+    }
+
 
 # ==============================
 # ANNOUNCEMENTS (ADMIN DASHBOARD)
 # ==============================
-@app.post("/api/announcements")
-async def create_announcement(data: Dict[str, Any], admin_id: int, db: Session = Depends(get_db)):
+# Polled every minute by the bot; cleared on create and mark-sent so a sent
+# announcement is never served as pending
+_announcements_cache = TTLCache(maxsize=1, ttl=30)
+
+@app.post("/api/announcements", status_code=202)
+async def create_announcement(data: Dict[str, Any], admin_id: int, db: AsyncSession = Depends(get_db)):
     ann = Announcement(
         message=data.get("message", ""),
         message_type=data.get("message_type", "general"),
@@ -414,30 +689,28 @@ async def create_announcement(data: Dict[str, Any], admin_id: int, db: Session =
         notify_all=1 if data.get("notify_all") else 0
     )
     db.add(ann)
-    db.commit()
-    db.refresh(ann)
-    return {"message": "Announcement created", "id": ann.id}
-
-@app.get("/api/announcements")
-async def list_announcements(db: Session = Depends(get_db)):
-    anns = db.query(Announcement).order_by(Announcement.created_at.desc()).limit(20).all()
-    return [
-        {
-            "id": a.id,
-            "message": a.message,
-            "created_at": a.created_at.isoformat(),
-            "sent_at": a.sent_at.isoformat() if a.sent_at else None
-        } for a in anns
-    ]
+    await db.commit()
+    _announcements_cache.clear()
+    # Delivery is done by the bot's send_announcements job, which picks up unsent rows
+    return {"message": "Announcement created", "id": ann.id, "status": "queued"}
+
+@app.get("/api/announcements", response_model=List[AnnouncementResponse])
+async def list_announcements(db: AsyncSession = Depends(get_db)):
+    anns = _announcements_cache.get("recent")
+    if anns is None:
+        rows = (await db.execute(select(Announcement).order_by(Announcement.created_at.desc()).limit(20))).scalars().all()
+        anns = _announcements_cache["recent"] = [AnnouncementResponse.model_validate(a) for a in rows]
+    return anns
 
 # ✅ Qo‘shimcha endpoint: e’lonni yuborilgan deb belgilash
 @app.put("/api/announcements/{announcement_id}/mark-sent")
-async def mark_announcement_sent(announcement_id: int, db: Session = Depends(get_db)):
-    ann = db.query(Announcement).filter(Announcement.id == announcement_id).first()
+async def mark_announcement_sent(announcement_id: int, db: AsyncSession = Depends(get_db)):
+    ann = await db.get(Announcement, announcement_id)
     if not ann:
         raise HTTPException(status_code=404, detail="Announcement not found")
     ann.sent_at = datetime.now(timezone.utc)
-    db.commit()
+    await db.commit()
+    _announcements_cache.clear()
     return {"message": "Announcement marked as sent", "id": ann.id}
 
 # ==============================
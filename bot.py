@@ -1,46 +1,64 @@
 import os
 import re
+import asyncio
+import json
 import aiohttp
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     CallbackQueryHandler,
     ContextTypes,
 )
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 
 # Configuration
 BOT_TOKEN = os.getenv("BOT_TOKEN", "8505705288:AAGb9UMdymiy4eIZ-y-_rwVz5ph5hqkU9gE")
 API_URL = os.getenv("API_URL", "http://localhost:8000/api")
 
+# Shared HTTP session, opened in post_init and closed in post_shutdown
+SESSION: aiohttp.ClientSession | None = None
+
 # =============================================================================
 # Helper functions
 # =============================================================================
 
 async def api_request(method: str, endpoint: str, data: dict = None, params: dict = None):
     url = f"{API_URL}/{endpoint}"
-    async with aiohttp.ClientSession() as session:
-        try:
-            if method == "GET":
-                async with session.get(url, params=params) as response:
-                    return await response.json()
-            elif method == "POST":
-                async with session.post(url, json=data, params=params) as response:
-                    return await response.json()
-            elif method == "PUT":
-                async with session.put(url, json=data, params=params) as response:
-                    return await response.json()
-            elif method == "DELETE":
-                async with session.delete(url, params=params) as response:
-                    return await response.json()
-        except Exception as e:
-            return {"error": str(e)}
+    try:
+        async with SESSION.request(method, url, json=data, params=params) as response:
+            return await response.json()
+    except Exception as e:
+        return {"error": str(e)}
+
+async def api_stream(endpoint: str, params: dict = None):
+    """Yield objects from a JSON-lines endpoint as they arrive."""
+    async with SESSION.get(f"{API_URL}/{endpoint}", params=params) as response:
+        response.raise_for_status()
+        async for line in response.content:
+            if line.strip():
+                yield json.loads(line)
+
+_FMTS = ("%d.%m.%Y", "%Y-%m-%d", "%d/%m/%Y")
+_DMY = re.compile(r"^(\d{1,2})([./])(\d{1,2})\2(\d{4})$")
+_YMD = re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})$")
+_HHMM = re.compile(r"^([01]\d|2[0-3]):([0-5]\d)$")
 
 def parse_date(date_str: str) -> datetime:
-    formats = ["%d.%m.%Y", "%Y-%m-%d", "%d/%m/%Y"]
-    for fmt in formats:
+    # Fast path: the fixed shapes users actually type, built without strptime
+    try:
+        m = _DMY.match(date_str)
+        if m:
+            return datetime(int(m.group(4)), int(m.group(3)), int(m.group(1)))
+        m = _YMD.match(date_str)
+        if m:
+            return datetime(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    except ValueError:
+        raise ValueError("❌ Sana formati noto'g'ri! DD.MM.YYYY ishlating.")
+    for fmt in _FMTS:
         try:
             return datetime.strptime(date_str, fmt)
         except ValueError:
@@ -60,6 +78,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "first_name": user.first_name,
         "last_name": user.last_name
     })
+    # New users get the default reminder time, which may be a new bucket
+    await schedule_reminders(context.application)
     await update.message.reply_text(f"""
 🌟 Assalomu alaykum, {user.first_name}!
 Sahifa sohili botiga xush kelibsiz! 📚
@@ -119,13 +139,12 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if date.date() > datetime.now().date():
         await update.message.reply_text("❌ Kelajak sanasi uchun natija qo'shib bo'lmaydi!")
         return
-    await api_request("POST", "reading-logs", {
+    user_data = await api_request("POST", "reading-logs", {
         "date": date.isoformat(),
         "pages": pages,
         "book_id": None
     }, params={"telegram_id": user.id})
-    user_data = await api_request("GET", f"users/by-telegram/{user.id}")
-    if not user_data or "detail" in user_data:
+    if not user_data or "detail" in user_data or "error" in user_data:
         await update.message.reply_text("❌ Foydalanuvchi ma'lumotlari topilmadi! Avval /start buyrug'ini yuboring.")
         return
     await update.message.reply_text(f"""
@@ -240,17 +259,7 @@ async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     text = f"🏆 {period.capitalize()} reytingi:\n\n"
 
     for entry in leaderboard:
-        # Agar entry dict bo‘lsa
-        if isinstance(entry, dict):
-            rank = entry.get("rank")
-            name = entry.get("name")
-            pages = entry.get("pages")
-        # Agar entry list/tuple bo‘lsa
-        elif isinstance(entry, (list, tuple)):
-            rank, name, pages = entry
-        else:
-            continue
-
+        rank, name, pages = entry["rank"], entry["name"], entry["pages"]
         medal = "🥇" if rank == 1 else "🥈" if rank == 2 else "🥉" if rank == 3 else ""
         text += f"{medal} {rank}. {name} - {pages} sahifa\n"
 
@@ -273,11 +282,12 @@ Eng uzun: {longest} kun
 async def reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     args = context.args
-    if len(args) != 1 or not re.match(r"^([01]\d|2[0-3]):([0-5]\d)$", args[0]):
+    if len(args) != 1 or not _HHMM.match(args[0]):
         await update.message.reply_text("❌ Format: /reminder HH:MM (masalan: 20:00)")
         return
     time_str = args[0]
     await api_request("PUT", f"users/{user.id}/update", {"reminder_time": time_str})
+    await schedule_reminders(context.application)
     await update.message.reply_text(f"✅ Har kuni {time_str} da eslatma yuboriladi.")
 
 # =============================================================================
@@ -299,72 +309,115 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Reminder scheduler
 # =============================================================================
 
-async def send_reminders(app):
-    users = await api_request("GET", "users/need-reminder")
-    if isinstance(users, dict) and "error" in users:
-        print("Reminder fetch error:", users["error"])
-        return
-    for u in users or []:
-        try:
-            await app.bot.send_message(
-                chat_id=u["telegram_id"],
-                text=f"🔔Asslomu alaykum  {u.get('first_name','')}! Bugun necha sahifa o'qiganingizni botga junatishingizni so'rab qolamiz! . Hurmat bilan Sahifa sohili bot! "
-            )
-        except Exception as e:
-            print("Reminder send error:", e)
+# Caps in-flight sends only; the pace (~30 msg/s, with retry on RetryAfter)
+# comes from the Application's AIORateLimiter
+SEND_CONCURRENCY = 25
+# Recipients are sent to in batches of this size, bounding pending send tasks
+RECIPIENT_BATCH = 500
 
+async def broadcast(bot, messages):
+    """Send (chat_id, text) pairs concurrently, at most SEND_CONCURRENCY at a time."""
+    sem = asyncio.Semaphore(SEND_CONCURRENCY)
 
-import requests
-from telegram import Update
-from telegram.ext import ContextTypes
+    async def one(chat_id, text):
+        async with sem:
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+            except Exception as e:
+                print(f"Failed to send to {chat_id}: {e}")
 
-API_URL = "http://localhost:8000/api"
+    await asyncio.gather(*(one(chat_id, text) for chat_id, text in messages))
 
-async def send_announcements(application):
-    try:
-        response = requests.get(f"{API_URL}/announcements")
-        announcements = response.json()
-        if not announcements:
-            return
+async def send_reminders(app, hhmm: str):
+    users = await api_request("GET", "users/need-reminder", params={"at": hhmm})
+    if isinstance(users, dict) and "error" in users:
+        print("Reminder fetch error:", users["error"])
+        return
+    await broadcast(app.bot, (
+        (u["telegram_id"],
+         f"🔔Asslomu alaykum  {u.get('first_name','')}! Bugun necha sahifa o'qiganingizni botga junatishingizni so'rab qolamiz! . Hurmat bilan Sahifa sohili bot! ")
+        for u in users or []
+    ))
+
+
+async def schedule_reminders(application):
+    """Keep exactly one cron job per distinct users.reminder_time (HH:MM)."""
+    scheduler = application.bot_data["scheduler"]
+    times = await api_request("GET", "users/reminder-times")
+    if isinstance(times, dict) and "error" in times:
+        print("Reminder times fetch error:", times["error"])
+        return
+    wanted = {f"reminder_{t}": t for t in times or [] if _HHMM.match(t)}
+    for job in scheduler.get_jobs():
+        if job.id.startswith("reminder_") and job.id not in wanted:
+            job.remove()
+    for job_id, hhmm in wanted.items():
+        if scheduler.get_job(job_id) is None:
+            hour, minute = hhmm.split(":")
+            scheduler.add_job(send_reminders, CronTrigger(hour=int(hour), minute=int(minute)), args=[application, hhmm], id=job_id)
 
-        for ann in announcements:
-            # faqat yuborilmagan e’lonlar
-            if ann.get("sent_at") is None:
-                message = ann["message"]
+async def send_announcements(application):
+    announcements = await api_request("GET", "announcements")
+    if isinstance(announcements, dict) and "error" in announcements:
+        print("Error fetching announcements:", announcements["error"])
+        return
+    # faqat yuborilmagan e’lonlar
+    pending = [ann for ann in announcements or [] if ann.get("sent_at") is None]
+    if not pending:
+        return
 
-                # Guruhga yuborish
-                group_id = -1002184957543  # o‘zingning guruh ID
-                await application.bot.send_message(chat_id=group_id, text=f"📢 {message}")
+    messages = [f"📢 {ann['message']}" for ann in pending]
 
-                # Har bir foydalanuvchiga yuborish
-                users = requests.get(f"{API_URL}/users").json()
-                for u in users:
-                    try:
-                        await application.bot.send_message(chat_id=u["telegram_id"], text=f"📢 {message}")
-                    except Exception as e:
-                        print(f"Failed to send to {u['telegram_id']}: {e}")
+    # Qabul qiluvchilar ro‘yxati avval to‘liq o‘qiladi (faqat ID lar): oqim
+    # xato bilan uzilsa hech kimga yuborilmaydi va keyingi urinish qayta yubormaydi
+    try:
+        chat_ids = [u["telegram_id"] async for u in api_stream("users/recipients")]
+    except Exception as e:
+        print("Error fetching recipients:", e)
+        return
 
-                # ✅ API’da e’lonni yuborilgan deb belgilash
-                requests.put(f"{API_URL}/announcements/{ann['id']}/mark-sent", json={})
+    # Guruhga yuborish
+    group_id = -1002184957543  # o‘zingning guruh ID
+    for text in messages:
+        try:
+            await application.bot.send_message(chat_id=group_id, text=text)
+        except Exception as e:
+            print(f"Failed to send to group: {e}")
 
-    except Exception as e:
-        print("Error fetching announcements:", e)
+    # Har bir foydalanuvchiga yuborish, bo‘laklab
+    for i in range(0, len(chat_ids), RECIPIENT_BATCH):
+        batch = chat_ids[i:i + RECIPIENT_BATCH]
+        await broadcast(application.bot, ((chat_id, text) for chat_id in batch for text in messages))
 
+    # ✅ API’da e’lonni yuborilgan deb belgilash
+    for ann in pending:
+        await api_request("PUT", f"announcements/{ann['id']}/mark-sent", {})
 
 
 # =============================================================================
 # Main
 # =============================================================================
 
-import asyncio 
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-
+async def post_init(application):
+    global SESSION
+    SESSION = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=60)
+    )
+    await schedule_reminders(application)
 
-import asyncio
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+async def post_shutdown(application):
+    if SESSION is not None:
+        await SESSION.close()
 
 def main():
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .rate_limiter(AIORateLimiter(max_retries=2))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Register commands
     application.add_handler(CommandHandler("start", start_command))
@@ -383,7 +436,10 @@ def main():
     # ✅ Event loopni qo‘l bilan olish
     loop = asyncio.get_event_loop()
     scheduler = AsyncIOScheduler(event_loop=loop)
-    scheduler.add_job(send_reminders, "interval", minutes=1, args=[application])
+    application.bot_data["scheduler"] = scheduler
+    # Reminder jobs are added per HH:MM bucket by schedule_reminders (post_init,
+    # /start, /reminder); the nightly resync picks up changes made elsewhere
+    scheduler.add_job(schedule_reminders, CronTrigger(hour=0, minute=0), args=[application])
     scheduler.add_job(send_announcements, "interval", minutes=1, args=[application])
 
     scheduler.start()